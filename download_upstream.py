@@ -11,8 +11,11 @@ from huggingface_hub import snapshot_download
 from scale_configs import available_scales
 
 
+_SCHEME_RE = re.compile(r"^[A-Za-z][A-Za-z0-9+\-.]*://")
+
+
 def path_or_cloudpath(s):
-    if re.match(r"^\w+://", s):
+    if _SCHEME_RE.match(s):
         return CloudPath(s)
     return Path(s)
 
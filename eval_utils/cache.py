@@ -0,0 +1,44 @@
+"""Persistent on-disk cache of evaluation metrics, keyed by checkpoint hash."""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "datacomp"
+    / "eval"
+)
+
+
+def checkpoint_hash(checkpoint_path, chunk_size=1 << 24):
+    """Content hash of a checkpoint file, computed in streaming chunks."""
+    hasher = hashlib.sha256()
+    with open(checkpoint_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def make_key(ckpt_hash, task_key):
+    return f"{ckpt_hash}__{task_key.replace('/', '-')}"
+
+
+def lookup(key):
+    """Return cached metrics for key, or None on a miss."""
+    path = CACHE_DIR / f"{key}.json"
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def store(key, metrics):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = CACHE_DIR / f"{key}.json"
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metrics, f)
+    os.replace(tmp_path, path)
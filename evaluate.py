@@ -1,7 +1,13 @@
 import argparse
+import concurrent.futures
+import fcntl
+import hashlib
 import json
+import multiprocessing
 import os
+import queue
 import re
+import sys
 import time
 import warnings
 from pathlib import Path
@@ -14,21 +20,146 @@ from cloudpathlib import CloudPath
 from huggingface_hub import (
     CommitOperationAdd,
     HfApi,
+    configure_http_backend,
 )
+from requests.adapters import HTTPAdapter, Retry
 from requests.structures import CaseInsensitiveDict
 
+from eval_utils import cache
 from eval_utils.main import evaluate_model
 
 warnings.filterwarnings("ignore", message="Length of IterableDataset")
 
 
+# RFC 3986 scheme grammar; \w would also (wrongly) match underscores.
+_SCHEME_RE = re.compile(r"^[A-Za-z][A-Za-z0-9+\-.]*://")
+
+
 def path_or_cloudpath(s):
-    if re.match(r"^\w+://", s):
+    if _SCHEME_RE.match(s):
         return CloudPath(s)
     return Path(s)
 
 
-def submit_to_firebase(training_info, args, results):
+def read_checkpoint_epoch(checkpoint_path):
+    """Read 'epoch' from a torch checkpoint without loading tensor data.
+
+    torch.save writes a zip archive whose data.pkl references tensor storages
+    through the pickle persistent-id mechanism. Unpickling with persistent
+    ids and torch classes stubbed out recovers the small metadata entries
+    (like the epoch counter) while skipping the multi-GB weights payload.
+    """
+    import pickle
+    import zipfile
+
+    class _Stub:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __setstate__(self, state):
+            pass
+
+    class _SkipTensorsUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            if module.startswith("torch"):
+                return _Stub
+            return super().find_class(module, name)
+
+        def persistent_load(self, pid):
+            return None
+
+    with zipfile.ZipFile(checkpoint_path) as archive:
+        pkl_name = next(
+            name for name in archive.namelist() if name.endswith("data.pkl")
+        )
+        with archive.open(pkl_name) as f:
+            data = _SkipTensorsUnpickler(f).load()
+    return data["epoch"]
+
+
+def run_one(task_key, train_info, args, tasks):
+    """Evaluate a single task and return its results.jsonl line as a dict."""
+    task_name = tasks[task_key].get("name", task_key)
+    cache_key = None
+    if args.cache and train_info.get("checkpoint_hash") is not None:
+        cache_key = cache.make_key(train_info["checkpoint_hash"], task_key)
+        metrics = cache.lookup(cache_key)
+        if metrics is not None:
+            print(f"Using cached metrics for {task_name}")
+            return {"key": task_key, "dataset": task_name, "metrics": metrics}
+    metrics = evaluate_model(
+        task_key,
+        train_info,
+        args.data_dir,
+        tasks[task_key].get("size"),
+        batch_size=args.batch_size,
+    )
+    metrics["main_metric"] = metrics.get(tasks[task_key].get("main_metric", "acc1"))
+    if cache_key is not None:
+        cache.store(cache_key, metrics)
+    return {"key": task_key, "dataset": task_name, "metrics": metrics}
+
+
+def _eval_worker(device_index, task_queue, result_queue, train_info, args, tasks):
+    # Pin this worker to one GPU, respecting any restriction inherited from
+    # the parent (e.g. CUDA_VISIBLE_DEVICES=2,3 under a Slurm allocation).
+    # CUDA reads CUDA_VISIBLE_DEVICES when the context is first initialized
+    # (not at torch import time), so setting it here, before any cuda call,
+    # is sufficient.
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    os.environ["CUDA_VISIBLE_DEVICES"] = (
+        visible.split(",")[device_index] if visible else str(device_index)
+    )
+    while True:
+        task_key = task_queue.get()
+        if task_key is None:
+            break
+        try:
+            line = run_one(task_key, train_info, args, tasks)
+        except Exception as e:
+            result_queue.put((task_key, None, f"{type(e).__name__}: {e}"))
+        else:
+            result_queue.put((task_key, line, None))
+
+
+def _prefetch_task(task_key, data_dir, max_shards=4):
+    """Warm the first few shards of a task's dataset ahead of its evaluation.
+
+    Local data only: ask the OS to page the shard files in so the loader's
+    first batches do not stall on cold reads. Cloud paths are left alone;
+    the wds reader streams shard URLs directly and never consults a local
+    cache, so downloading ahead would only burn bandwidth. Best-effort only:
+    any failure is ignored and the evaluation itself reads what it needs.
+    """
+    if data_dir is None or _SCHEME_RE.match(str(data_dir)):
+        return
+    if not hasattr(os, "posix_fadvise"):
+        return
+    data_folder = f"wds_{task_key.replace('/', '-')}_test"
+    try:
+        task_root = Path(str(data_dir)) / data_folder
+        shards = sorted(task_root.rglob("*.tar"))[:max_shards]
+        for shard in shards:
+            fd = os.open(shard, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+    except Exception:
+        pass
+
+
+def append_result(results_fp, line):
+    # Lock the results file so concurrent invocations sharing an output dir
+    # cannot interleave partial lines. Flush per line so a crash mid-run
+    # loses at most the task in flight.
+    fcntl.flock(results_fp, fcntl.LOCK_EX)
+    results_fp.write(json.dumps(line) + "\n")
+    results_fp.flush()
+    fcntl.flock(results_fp, fcntl.LOCK_UN)
+
+
+def _firebase_entry(training_info, args, results):
     timestamp = strftime("%Y-%m-%d_%H:%M:%S", gmtime())
     data = {
         "scale": training_info["scale"],
@@ -56,6 +187,11 @@ def submit_to_firebase(training_info, args, results):
     hf_hub_dirname = data["hf_repo_name"]
 
     key = f"{hf_hub_username}__{hf_hub_dirname}__{timestamp}".replace(".", "_")
+    return key, data
+
+
+def submit_to_firebase(training_info, args, results):
+    key, data = _firebase_entry(training_info, args, results)
 
     url = f"https://laion-tng-default-rtdb.firebaseio.com/{key}.json"
 
@@ -68,19 +204,13 @@ def submit_to_firebase(training_info, args, results):
     return resp
 
 
-def submit_to_slack(train_info, args, results):
+def _slack_message(train_info, args, results):
     scale = train_info.get("scale", "undefined")
     hf_hub_username = args.hf_username
     hf_hub_dirname = args.hf_repo_name
     hf_url = f"https://huggingface.co/{hf_hub_username}/{hf_hub_dirname}"
 
-    avg_acc = np.mean(
-        [
-            val["metrics"]["main_metric"]
-            for val in results.values()
-            if val["metrics"]["main_metric"] is not None
-        ]
-    )
+    avg_acc = _avg_main(results)
     imagenet_acc = results["ImageNet 1k"]["metrics"]["acc1"]
 
     message = (
@@ -92,6 +222,11 @@ def submit_to_slack(train_info, args, results):
         message = message[:-1] + f", more details at {hf_url}."
     if args.writeup:
         message += f' Writeup: {args.writeup}'
+    return message
+
+
+def submit_to_slack(train_info, args, results):
+    message = _slack_message(train_info, args, results)
 
     root = "hooks.slack.com"
     part1 = "T01AEJ66KHV"
@@ -107,7 +242,123 @@ def submit_to_slack(train_info, args, results):
     return resp
 
 
+def _avg_main(results):
+    """Average of main_metric over all tasks that report one."""
+    return float(
+        np.fromiter(
+            (
+                val["metrics"]["main_metric"]
+                for val in results.values()
+                if val["metrics"]["main_metric"] is not None
+            ),
+            dtype=np.float64,
+        ).mean()
+    )
+
+
+def _submit_with_retry(submit_fn, train_info, args, results, attempts=3):
+    resp = None
+    for attempt in range(attempts):
+        try:
+            resp = submit_fn(train_info, args, results)
+            if resp.status_code == 200:
+                return resp
+        except requests.RequestException:
+            resp = None
+        if attempt < attempts - 1:
+            time.sleep(2**attempt)
+    return resp
+
+
+SUBMIT_URL_ENV = "DATACOMP_SUBMIT_URL"
+
+
+def submit_combined(train_info, args, results):
+    """Send one payload to a relay endpoint that fans out server-side.
+
+    The relay (see serverless/submit_function) performs the Firebase write
+    and the Slack post itself, so the client pays a single round-trip.
+    """
+    payload = {"firebase": None, "slack": None}
+    if not args.skip_db:
+        key, data = _firebase_entry(train_info, args, results)
+        payload["firebase"] = {"key": key, "data": data}
+    if not args.skip_notification:
+        payload["slack"] = {"text": _slack_message(train_info, args, results)}
+    return requests.post(os.environ[SUBMIT_URL_ENV], json=payload, timeout=15)
+
+
+def submit_all(train_info, args, results):
+    """Send the Firebase and Slack submissions concurrently.
+
+    Each submission is network-bound, so running them in parallel bounds the
+    total wait by the slower of the two instead of their sum. If a relay
+    endpoint is configured through DATACOMP_SUBMIT_URL, both go out as one
+    request instead. Returns True if every enabled submission succeeded.
+    """
+    if os.environ.get(SUBMIT_URL_ENV) and not (args.skip_db and args.skip_notification):
+        resp = _submit_with_retry(submit_combined, train_info, args, results)
+        return resp is not None and resp.status_code == 200
+    submit_fns = []
+    if not args.skip_db:
+        submit_fns.append(submit_to_firebase)
+    if not args.skip_notification:
+        submit_fns.append(submit_to_slack)
+    if not submit_fns:
+        return True
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(submit_fns)) as pool:
+        futures = [
+            pool.submit(_submit_with_retry, fn, train_info, args, results)
+            for fn in submit_fns
+        ]
+        responses = [future.result() for future in futures]
+    return all(resp is not None and resp.status_code == 200 for resp in responses)
+
+
+def _file_sha256(filename, chunk_size=1 << 24):
+    # .open works for both Path and CloudPath, so cloud files hash through
+    # the same streaming loop (via the cloudpathlib local cache).
+    hasher = hashlib.sha256()
+    with filename.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _existing_repo_hashes(hf_api, repo_id, paths_in_repo):
+    """Map path_in_repo -> sha256 for files already uploaded as LFS objects."""
+    existing = {}
+    try:
+        infos = hf_api.get_paths_info(repo_id, paths_in_repo)
+    except Exception:
+        return existing
+    for info in infos:
+        lfs = getattr(info, "lfs", None)
+        if lfs is None:
+            continue
+        sha = lfs["sha256"] if isinstance(lfs, dict) else getattr(lfs, "sha256", None)
+        if sha is not None:
+            existing[info.path] = sha
+    return existing
+
+
+def _hub_session_factory():
+    # One pooled session for all hub requests: connections get reused across
+    # the many upload calls in a commit instead of re-handshaking, and
+    # transient errors are retried with backoff.
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def push_files_to_hub(train_info, args, results_filename):
+    configure_http_backend(backend_factory=_hub_session_factory)
     if "::" in str(args.samples):
         sample_files = [
             path_or_cloudpath(subdir) for subdir in str(args.samples).split("::")
@@ -119,7 +370,7 @@ def push_files_to_hub(train_info, args, results_filename):
             f"Expected one or more files containing the sample ids but found none."
         )
 
-    hf_api = HfApi()
+    hf_api = HfApi(user_agent="datacomp")
     repo_id = args.hf_username + "/" + args.hf_repo_name
     print(f"Pushing files to HF Hub ({repo_id}). This may take a while.")
     results_filename = str(results_filename)
@@ -140,12 +391,36 @@ def push_files_to_hub(train_info, args, results_filename):
             )
         )
 
+    # Hash each sample file once so duplicate --samples entries upload a
+    # single copy, and files whose bytes already sit in the repo (from a
+    # previous submission) are skipped entirely.
+    existing = _existing_repo_hashes(
+        hf_api,
+        repo_id,
+        list({f"{prefix}/samples/{filename.name}" for filename in sample_files}),
+    )
+    seen = {}
     for filename in sample_files:
-        fileobj = filename.read_bytes()
+        path_in_repo = f"{prefix}/samples/{filename.name}"
+        digest = _file_sha256(filename)
+        if digest in seen:
+            print(f"Skipping {filename.name}: duplicate of {seen[digest]}")
+            continue
+        seen[digest] = path_in_repo
+        if existing.get(path_in_repo) == digest:
+            print(f"Skipping {filename.name}: already uploaded to {repo_id}")
+            continue
+        # Hand the hub client a path (local) or a file object (cloud) so it
+        # can stream the upload in chunks instead of holding every sample
+        # file in memory at once.
+        if isinstance(filename, CloudPath):
+            fileobj = filename.open("rb")
+        else:
+            fileobj = str(filename)
         operations.append(
             CommitOperationAdd(
                 path_or_fileobj=fileobj,
-                path_in_repo=f"{prefix}/samples/{filename.name}",
+                path_in_repo=path_in_repo,
             )
         )
 
@@ -182,6 +457,18 @@ if __name__ == "__main__":
     parser.add_argument("--epoch", default=-1, type=int, help="Epoch to evaluate. If < 0, will use 'epoch_latest'")
     parser.add_argument("--iter", default=-1, type=int, help="Iteration to evaluate. If < 0, will use 'epoch_latest'")
     parser.add_argument("--arch", default="", type=str, help="Architecture of the model")
+    parser.add_argument(
+        "--num_eval_workers",
+        default=None,
+        type=int,
+        help="Number of parallel evaluation workers (one per GPU). Defaults to the number of visible CUDA devices.",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Reuse metrics cached on disk for this (checkpoint, task) pair, keyed by checkpoint content hash.",
+    )
 
     # Submission flags
     parser_submit = parser.add_argument_group("submission")
@@ -302,26 +589,31 @@ if __name__ == "__main__":
     else:
         checkpoint_path = args.train_output_dir / "checkpoints" / "epoch_latest.pt"
         try:
-            import torch
-            data = torch.load(checkpoint_path, map_location="cpu")
-            prefix = f"epoch_{data['epoch']}_"
-        except:
-            pass
+            prefix = f"epoch_{read_checkpoint_epoch(checkpoint_path)}_"
+        except Exception:
+            # Legacy (non-zip) checkpoints: fall back to a full load.
+            try:
+                import torch
+                data = torch.load(checkpoint_path, map_location="cpu")
+                prefix = f"epoch_{data['epoch']}_"
+            except:
+                pass
     train_info = {"scale_config": {"model": args.arch}, "checkpoint": checkpoint_path}
 
     results_filename = args.train_output_dir / "eval_results" / f"{prefix}eval_results.jsonl"
 
-    # Get list of datasets
+    # Get list of datasets. Use the libyaml C loader when available; the
+    # pure-python fallback is an order of magnitude slower on this file.
     with open(os.path.join(os.path.dirname(__file__), "tasklist.yml")) as f:
-        tasks = yaml.safe_load(f)
+        tasks = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
     # Check for cached results
     results = {}
     # Read existing results
     if results_filename.exists():
         with open(results_filename, "r") as f:
-            lines = [json.loads(s) for s in f.readlines()]
-            for line in lines:
+            for s in f:
+                line = json.loads(s)
                 if line["key"] not in tasks:
                     continue
                 results[line["dataset"]] = line
@@ -343,10 +635,19 @@ if __name__ == "__main__":
         print("Defaulting to", default_checkpoint_name)
         train_info["checkpoint"] = default_checkpoint_name
 
+    if args.cache:
+        try:
+            train_info["checkpoint_hash"] = cache.checkpoint_hash(
+                train_info["checkpoint"]
+            )
+        except OSError:
+            train_info["checkpoint_hash"] = None
+
     print("Evaluating")
 
     starttime = int(time.time())
 
+    pending_task_keys = []
     for task_key in tasks:
         task_name = tasks[task_key].get("name", task_key)
         if task_name in results:
@@ -354,48 +655,124 @@ if __name__ == "__main__":
                 f"Skipping {task_name} since results are already in {results_filename}"
             )
         else:
-            print(f"Evaluating on {task_name}")
-            metrics = evaluate_model(
-                task_key,
-                train_info,
-                args.data_dir,
-                tasks[task_key].get("size"),
-                batch_size=args.batch_size,
-            )
-            metrics["main_metric"] = metrics.get(
-                tasks[task_key].get("main_metric", "acc1")
-            )
-            results[task_name] = {
-                "key": task_key,
-                "dataset": task_name,
-                "metrics": metrics,
-            }
-            with open(results_filename, "a+") as f:
-                f.write(json.dumps(results[task_name]) + "\n")
-
-        if results[task_name]["metrics"]["main_metric"] is not None:
-            print(f"Score: {results[task_name]['metrics']['main_metric']:.4f}")
+            pending_task_keys.append(task_key)
+
+    if args.num_eval_workers is None:
+        import torch
+
+        args.num_eval_workers = torch.cuda.device_count()
+    num_workers = min(max(args.num_eval_workers, 1), max(len(pending_task_keys), 1))
+
+    # Buffer per-task score lines instead of printing inside the loop, so a
+    # slow terminal (e.g. CI log streaming) never blocks the compute loop.
+    score_lines = []
+
+    def record_score(line):
+        if line["metrics"]["main_metric"] is not None:
+            score_lines.append(f"{line['dataset']}: {line['metrics']['main_metric']:.4f}")
+        else:
+            score_lines.append(f"{line['dataset']}: No summary metric")
+
+    # One handle for the whole run instead of an open/close per task; fsync
+    # once at the end to make the appended lines durable.
+    results_fp = open(results_filename, "a", encoding="utf-8")
+    try:
+        if num_workers <= 1:
+            # While task i evaluates, warm task i+1's first shards in the
+            # background so its first batches do not stall on cold reads.
+            prefetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+            try:
+                for i, task_key in enumerate(pending_task_keys):
+                    if i + 1 < len(pending_task_keys):
+                        prefetch_pool.submit(
+                            _prefetch_task, pending_task_keys[i + 1], args.data_dir
+                        )
+                    task_name = tasks[task_key].get("name", task_key)
+                    print(f"Evaluating on {task_name}")
+                    results[task_name] = run_one(task_key, train_info, args, tasks)
+                    append_result(results_fp, results[task_name])
+                    record_score(results[task_name])
+            finally:
+                prefetch_pool.shutdown(wait=False)
         else:
-            print(f"Score: No summary metric")
+            # One worker per GPU pulls task keys from a queue; the main process
+            # collects results and owns all writes to the results file.
+            print(f"Running evaluations with {num_workers} worker(s)")
+            ctx = multiprocessing.get_context("spawn")
+            task_queue = ctx.Queue()
+            result_queue = ctx.Queue()
+            for task_key in pending_task_keys:
+                task_queue.put(task_key)
+            workers = []
+            for device_index in range(num_workers):
+                task_queue.put(None)
+                proc = ctx.Process(
+                    target=_eval_worker,
+                    args=(device_index, task_queue, result_queue, train_info, args, tasks),
+                )
+                proc.start()
+                workers.append(proc)
+
+            failures = []
+            received = 0
+            while received < len(pending_task_keys):
+                try:
+                    task_key, line, error = result_queue.get(timeout=30)
+                except queue.Empty:
+                    # A worker killed without posting a result (OOM, CUDA
+                    # driver abort) loses only its in-flight task; survivors
+                    # keep draining the queue and their results are still
+                    # collected and written. Stop waiting only when no worker
+                    # is left to produce the missing results.
+                    if not any(proc.is_alive() for proc in workers):
+                        break
+                    continue
+                received += 1
+                task_name = tasks[task_key].get("name", task_key)
+                if error is not None:
+                    print(f"Evaluation failed on {task_name}: {error}")
+                    failures.append(task_name)
+                    continue
+                results[task_name] = line
+                append_result(results_fp, line)
+                print(f"Evaluated {task_name}")
+                record_score(line)
+            for proc in workers:
+                proc.join()
+            missing = len(pending_task_keys) - received
+            if failures or missing:
+                problems = []
+                if failures:
+                    problems.append(f"task(s) failed: {', '.join(failures)}")
+                if missing:
+                    lost = f"{missing} result(s) lost to dead worker(s)"
+                    exit_codes = [
+                        proc.exitcode for proc in workers if proc.exitcode != 0
+                    ]
+                    if exit_codes:
+                        lost += f" (exit codes: {exit_codes})"
+                    problems.append(lost)
+                raise RuntimeError(f"Evaluation incomplete: {'; '.join(problems)}")
+    finally:
+        results_fp.flush()
+        os.fsync(results_fp.fileno())
+        results_fp.close()
 
     elapsed = int(time.time()) - starttime
-    print(
+    out_lines = score_lines
+    out_lines.append(
         f"Evaluation time: {elapsed // 3600} hour(s) {elapsed % 3600 // 60} minute(s) {elapsed % 60} second(s)"
     )
-    print()
-    print("=== Final results ===")
+    out_lines.append("")
+    out_lines.append("=== Final results ===")
     for line in results.values():
-        print(f"{line['dataset']}: {line['metrics']['main_metric']}")
+        out_lines.append(f"{line['dataset']}: {line['metrics']['main_metric']}")
     if args.submit:
-        print("=====================")
-        average = np.mean(
-            [
-                val["metrics"]["main_metric"]
-                for val in results.values()
-                if val["metrics"]["main_metric"] is not None
-            ]
-        )
-        print(f"Average: {average}")
+        out_lines.append("=====================")
+        average = _avg_main(results)
+        out_lines.append(f"Average: {average}")
+    sys.stdout.write("\n".join(out_lines) + "\n")
+    sys.stdout.flush()
 
     if args.submit:
         print("Done with evaluations. Preparing your submission...")
@@ -410,23 +787,10 @@ if __name__ == "__main__":
         """
         error_msg = "=" * 100 + "\n" + error_msg + "\n" + "=" * 100
 
-        # Submit jsonl to firebase
-        if not args.skip_db:
-            resp = submit_to_firebase(train_info, args, results)
-            if resp.status_code != 200:
-                print(error_msg)
-                import sys
-
-                sys.exit()
-
-        # Slack notification
-        if not args.skip_notification:
-            resp = submit_to_slack(train_info, args, results)
-            if resp.status_code != 200:
-                print(error_msg)
-                import sys
-
-                sys.exit()
+        # Submit jsonl to firebase and send the Slack notification in parallel
+        if not submit_all(train_info, args, results):
+            print(error_msg)
+            sys.exit()
 
         print(
             "Sucessfully submitted your results. Thanks for participating, and good luck!"
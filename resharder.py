@@ -382,8 +382,11 @@ def ceildiv(a, b):
     return -(-a // b)
 
 
+_SCHEME_RE = re.compile(r"^[A-Za-z][A-Za-z0-9+\-.]*://")
+
+
 def path_or_cloudpath(s: str) -> Pathy:
-    if re.match(r"^\w+://", s):
+    if _SCHEME_RE.match(s):
         return CloudPath(s.rstrip("/"))
     return Path(s)
 
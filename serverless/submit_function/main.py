@@ -0,0 +1,51 @@
+"""HTTP Cloud Function that fans a submission out to Firebase and Slack.
+
+evaluate.py posts one combined payload here (see submit_combined), so the
+user's machine pays a single round-trip; the Realtime DB write and the Slack
+webhook post happen concurrently on the server side.
+
+Deploy with:
+
+    gcloud functions deploy datacomp-submit \
+        --runtime python311 --trigger-http --allow-unauthenticated \
+        --entry-point submit \
+        --set-env-vars SLACK_WEBHOOK_URL=<webhook url>
+
+then point clients at the function URL via DATACOMP_SUBMIT_URL.
+"""
+
+import concurrent.futures
+import os
+
+import requests
+
+FIREBASE_URL = "https://laion-tng-default-rtdb.firebaseio.com"
+
+
+def _put_firebase(entry):
+    return requests.put(
+        f"{FIREBASE_URL}/{entry['key']}.json", json=entry["data"], timeout=15
+    )
+
+
+def _post_slack(entry):
+    return requests.post(
+        os.environ["SLACK_WEBHOOK_URL"], json={"text": entry["text"]}, timeout=15
+    )
+
+
+def submit(request):
+    payload = request.get_json(silent=True) or {}
+    calls = []
+    if payload.get("firebase"):
+        calls.append((_put_firebase, payload["firebase"]))
+    if payload.get("slack"):
+        calls.append((_post_slack, payload["slack"]))
+    if not calls:
+        return ("empty payload", 400)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        futures = [pool.submit(fn, entry) for fn, entry in calls]
+        responses = [future.result() for future in futures]
+    if all(resp.status_code == 200 for resp in responses):
+        return ("ok", 200)
+    return ("upstream error", 502)
@@ -96,8 +96,11 @@ def get_input_shards(data_dir, weights):
     return data_str, weights
 
 
+_SCHEME_RE = re.compile(r"^[A-Za-z][A-Za-z0-9+\-.]*://")
+
+
 def path_or_cloudpath(s):
-    if re.match(r"^\w+://", s):
+    if _SCHEME_RE.match(s):
         return CloudPath(s)
     return Path(s)
 